@@ -0,0 +1,315 @@
+"""Background execution of analysis runs for the Streamlit UI."""
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Coroutine, Dict, List, Sequence, Set, Tuple
+
+from analysis_utils import (
+    analyze_audio_batch_async,
+    analyze_audio_stream_async,
+    existing_analysis_fingerprints,
+)
+from app_utils import save_analysis, should_skip_analysis
+from video_processing import iter_converted_audio
+
+# Batch states, in the order a batch moves through them.
+BATCH_QUEUED = "queued"
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+BATCH_FAILED = "failed"
+BATCH_CANCELLED = "cancelled"
+
+
+@dataclass
+class BatchProgress:
+    """Progress of one Gen AI request covering ``audio_files``."""
+
+    audio_files: List[str]
+    status: str = BATCH_QUEUED
+    text: str = ""
+    results: Dict[str, str] = field(default_factory=dict)
+    error: str | None = None
+    # Base names for display, computed once rather than on every poll.
+    audio_names: List[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.audio_names = [Path(audio_file).name for audio_file in self.audio_files]
+
+
+@dataclass
+class AnalysisJob:
+    """An analysis run executing on a background thread.
+
+    The worker only posts events to :attr:`events` and reads
+    :attr:`cancel_requested`; :meth:`drain` applies the events on the script
+    thread, so Streamlit is never called from the worker.
+    """
+
+    batches: List[BatchProgress] = field(default_factory=list)
+    skipped_files: List[str] = field(default_factory=list)
+    # ``(completed, total)`` videos while a pipeline job is converting, else ``None``.
+    conversion: Tuple[int, int] | None = None
+    conversion_error: str | None = None
+    events: "queue.Queue[Tuple[str, int, object]]" = field(default_factory=queue.Queue)
+    cancel_requested: threading.Event = field(default_factory=threading.Event)
+    finished: bool = False
+
+    @property
+    def completed(self) -> int:
+        return sum(batch.status not in (BATCH_QUEUED, BATCH_RUNNING) for batch in self.batches)
+
+    def cancel(self) -> None:
+        """Stop starting new requests; requests already in flight still finish."""
+
+        self.cancel_requested.set()
+
+    def drain(self) -> None:
+        """Apply all events posted by the worker since the last call."""
+
+        while True:
+            try:
+                kind, index, payload = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+            if kind == "finished":
+                self.finished = True
+                continue
+            if kind == "batch":
+                self.batches.append(BatchProgress(payload))
+                continue
+            if kind == "skipped":
+                self.skipped_files.append(payload)
+                continue
+            if kind == "converted":
+                self.conversion = payload
+                continue
+            if kind == "conversion_failed":
+                self.conversion_error = payload
+                continue
+
+            batch = self.batches[index]
+            if kind == "started":
+                batch.status = BATCH_RUNNING
+            elif kind == "delta":
+                batch.text += payload
+            elif kind == "done":
+                batch.status = BATCH_DONE
+                batch.results = payload
+            elif kind == "failed":
+                batch.status = BATCH_FAILED
+                batch.error = payload
+            elif kind == "cancelled":
+                batch.status = BATCH_CANCELLED
+
+
+async def _iter_batches(batches: Sequence[List[str]]) -> AsyncIterator[List[str]]:
+    for batch in batches:
+        yield batch
+
+
+async def _converted_batches(
+    job: AnalysisJob,
+    video_folder: str | Path,
+    existing_analyses: Dict[str, str | None] | None,
+    prompt: str,
+    model_name: str,
+    batch_size: int,
+    max_batch_bytes: int,
+) -> AsyncIterator[List[str]]:
+    """Convert *video_folder* and yield batches of audio files as they become ready.
+
+    Batches follow the same limits as ``app_utils.chunked_by_size``, but each
+    is released as soon as it is full or conversion has finished, so analysis
+    overlaps with the remaining conversions. Files with a current analysis in
+    *existing_analyses* are skipped; pass ``None`` to analyse every file.
+    """
+
+    loop = asyncio.get_running_loop()
+    converted: "asyncio.Queue[str | None]" = asyncio.Queue()
+
+    def convert() -> None:
+        conversions = iter_converted_audio(video_folder)
+        try:
+            for audio_file, completed, total in conversions:
+                if job.cancel_requested.is_set():
+                    break
+                job.events.put(("converted", -1, (completed, total)))
+                if audio_file:
+                    loop.call_soon_threadsafe(converted.put_nowait, audio_file)
+        except Exception as exc:  # pragma: no cover - e.g. a crashed worker process
+            job.events.put(("conversion_failed", -1, str(exc) or type(exc).__name__))
+        finally:
+            # Cancels the conversions not started yet and shuts the pool down.
+            conversions.close()
+            loop.call_soon_threadsafe(converted.put_nowait, None)
+
+    # A dedicated thread, so the wait for conversions never takes a slot in the
+    # default executor that the Gen AI requests rely on.
+    threading.Thread(target=convert, name="analysis-convert", daemon=True).start()
+
+    seen: Set[str] = set()
+    batch: List[str] = []
+    batch_bytes = 0
+    while (audio_file := await converted.get()) is not None:
+        if audio_file in seen:
+            continue
+        seen.add(audio_file)
+        if should_skip_analysis(audio_file, existing_analyses is not None, prompt, model_name, existing_analyses):
+            job.events.put(("skipped", -1, audio_file))
+            continue
+
+        try:
+            size = os.stat(audio_file).st_size
+        except OSError:
+            # Batch it anyway; the request then fails and reports the file.
+            size = 0
+        if batch and batch_bytes + size > max_batch_bytes:
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(audio_file)
+        batch_bytes += size
+        if len(batch) >= batch_size:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def _save_results(results: Dict[str, str], prompt: str, model_name: str) -> None:
+    for audio_file, response_text in results.items():
+        save_analysis(audio_file, response_text, prompt, model_name)
+
+
+async def _run_job(
+    job: AnalysisJob,
+    batches: AsyncIterator[List[str]],
+    prompt: str,
+    client,
+    model_name: str,
+    concurrency: int,
+    batch_size: int,
+    cache: bool,
+) -> None:
+    post = job.events.put
+    semaphore = asyncio.Semaphore(concurrency)
+    # All blocking work runs on the loop's default executor: per request, up
+    # to batch_size uploads or inline reads, then one stream read at a time,
+    # plus the save of a finished batch while the next request runs. Size it
+    # for that load, and never below asyncio's own default.
+    workers = max(min(32, (os.cpu_count() or 1) + 4), concurrency * (batch_size + 2))
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=workers, thread_name_prefix="genai")
+    )
+
+    async def run_batch(index: int, batch: List[str]) -> None:
+        # Any failure is confined to this batch: it is reported as failed and
+        # the other batches keep running.
+        try:
+            async with semaphore:
+                if job.cancel_requested.is_set():
+                    post(("cancelled", index, None))
+                    return
+
+                post(("started", index, None))
+                if len(batch) > 1:
+                    results = await analyze_audio_batch_async(
+                        batch,
+                        prompt,
+                        client,
+                        model_name,
+                        cache=cache,
+                        on_text=lambda delta: post(("delta", index, delta)),
+                    )
+                else:
+                    text = ""
+                    async for delta in analyze_audio_stream_async(batch[0], prompt, client, model_name, cache=cache):
+                        text += delta
+                        post(("delta", index, delta))
+                    results = {batch[0]: text.strip()}
+
+            # Saving fsyncs each file, so keep it off the event loop; other
+            # requests keep streaming while a finished batch is written out.
+            await asyncio.to_thread(_save_results, results, prompt, model_name)
+        except Exception as exc:
+            post(("failed", index, str(exc) or type(exc).__name__))
+            return
+
+        post(("done", index, results))
+
+    tasks = []
+    try:
+        try:
+            index = 0
+            async for batch in batches:
+                post(("batch", index, batch))
+                tasks.append(asyncio.create_task(run_batch(index, batch)))
+                index += 1
+        except Exception as exc:
+            # Only the pipeline's batch source can fail here; batches already
+            # started still run to completion.
+            post(("conversion_failed", -1, str(exc) or type(exc).__name__))
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        post(("finished", -1, None))
+
+
+def _start(job: AnalysisJob, job_coroutine: Coroutine[Any, Any, None]) -> AnalysisJob:
+    thread = threading.Thread(target=asyncio.run, args=(job_coroutine,), name="analysis-job", daemon=True)
+    thread.start()
+    return job
+
+
+def start_analysis_job(
+    batches: Sequence[List[str]],
+    skipped_files: Sequence[str],
+    prompt: str,
+    client,
+    model_name: str,
+    *,
+    concurrency: int,
+    cache: bool,
+) -> AnalysisJob:
+    """Start analysing *batches* on a daemon thread and return the job tracking it.
+
+    Results are saved by the worker as they arrive, so they are kept even if
+    the browser session goes away mid-run.
+    """
+
+    job = AnalysisJob(skipped_files=list(skipped_files))
+    batch_lists = [list(batch) for batch in batches]
+    batch_size = max(map(len, batch_lists), default=1)
+    return _start(
+        job, _run_job(job, _iter_batches(batch_lists), prompt, client, model_name, concurrency, batch_size, cache)
+    )
+
+
+def start_pipeline_job(
+    video_folder: str | Path,
+    prompt: str,
+    client,
+    model_name: str,
+    *,
+    batch_size: int,
+    max_batch_bytes: int,
+    concurrency: int,
+    skip_existing: bool,
+) -> AnalysisJob:
+    """Convert the videos in *video_folder* and analyse each batch as soon as its audio is ready.
+
+    Files whose analysis is still current for *prompt* and *model_name* are
+    skipped when *skip_existing* is set, which also enables the response cache,
+    as in :func:`start_analysis_job`.
+    """
+
+    job = AnalysisJob(conversion=(0, 0))
+    batch_size = max(1, batch_size)
+    existing_analyses = existing_analysis_fingerprints() if skip_existing else None
+    batches = _converted_batches(job, video_folder, existing_analyses, prompt, model_name, batch_size, max_batch_bytes)
+    return _start(job, _run_job(job, batches, prompt, client, model_name, concurrency, batch_size, skip_existing))
@@ -1,30 +1,99 @@
 """Helpers for working with Google Gen AI and stored analyses."""
 from __future__ import annotations
 
+import asyncio
+import datetime
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import weakref
 from pathlib import Path
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Sequence, Set, Tuple
 
-from google import genai
-from google.genai import types
-from google.oauth2 import service_account
+from paths import (
+    ANALYSIS_CACHE_DIR,
+    ANALYSIS_DIR,
+    ANALYSIS_INDEX,
+    ensure_output_dirs,
+    recreate_output_dirs,
+    write_text_atomic,
+)
 
-from paths import ANALYSIS_DIR, ensure_output_dirs
+# The Google SDKs are imported where they are first needed so that importing
+# this module (and painting the UI) does not pay for them up front.
+if TYPE_CHECKING:
+    from google.genai import types
+    from google.oauth2 import service_account
+
+# Analysis files are stored as ``<audio stem>_analysis.txt``.
+_ANALYSIS_SUFFIX = "_analysis.txt"
+_ANALYSIS_SUFFIX_LEN = len(_ANALYSIS_SUFFIX)
+
+# Read size used when hashing audio files for the analysis cache.
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Audio files at least this large are hashed through a read-only memory map.
+_MMAP_THRESHOLD = 32 * 1024 * 1024
+
+# Analysis files at least this large are read through a read-only memory map.
+_READ_MMAP_THRESHOLD = 64 * 1024
+
+# Files API uploads per client, keyed on (resolved path, mtime_ns, size).
+_uploaded_files: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+# Vertex AI clients whose OAuth token has been (or is being) fetched.
+_warmed_clients: weakref.WeakSet = weakref.WeakSet()
+
+# Uploads closer than this to their expiry are replaced rather than reused.
+_UPLOAD_EXPIRY_MARGIN = datetime.timedelta(hours=1)
+
+# Marker the model is asked to emit before each file's section in batched requests.
+_BATCH_SECTION_RE = re.compile(r"^===FILE (\d+)===[ \t]*$", re.MULTILINE)
+
+BATCH_PROMPT_TEMPLATE = """You will receive {count} audio files, numbered 1 to {count} in the order given.
+Follow the instructions below for each file independently.
+Start the answer for file N with a line containing exactly ===FILE N=== and nothing else.
+
+{prompt}"""
 
 ###############################################################################
 # Initialize Gen AI Client
 ###############################################################################
 
+@functools.lru_cache(maxsize=8)
+def _load_sa_creds(path: str, mtime: float) -> service_account.Credentials:
+    """Load scoped service-account credentials; *mtime* only keys the cache."""
+
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_file(path).with_scopes(
+        ["https://www.googleapis.com/auth/cloud-platform"]
+    )
+
+
 def initialize_genai_client(api_choice: str, credentials: str | None, project_id: str | None, location: str | None):
     """Initialise a Google Gen AI client for Gemini API or Vertex AI."""
 
+    from google import genai
+
     if api_choice == "Vertex AI":
         if not credentials or not Path(credentials).exists():
             raise RuntimeError("Invalid GCP credentials file path. Please check your input.")
 
         try:
-            gcp_credentials = service_account.Credentials.from_service_account_file(credentials).with_scopes(
-                ["https://www.googleapis.com/auth/cloud-platform"]
-            )
+            gcp_credentials = _load_sa_creds(credentials, os.path.getmtime(credentials))
+        except FileNotFoundError as exc:
+            _load_sa_creds.cache_clear()
+            raise RuntimeError("Invalid GCP credentials file path. Please check your input.") from exc
+        except Exception as exc:  # pragma: no cover - depends on external files
+            raise RuntimeError(f"Failed to load GCP credentials: {exc}") from exc
+
+        try:
             return genai.Client(vertexai=True, project=project_id, location=location, credentials=gcp_credentials)
         except Exception as exc:  # pragma: no cover - depends on external files
             raise RuntimeError(f"Failed to load GCP credentials: {exc}") from exc
@@ -37,53 +106,470 @@ def initialize_genai_client(api_choice: str, credentials: str | None, project_id
     raise RuntimeError("Invalid API selection. Choose 'Gemini API' or 'Vertex AI'.")
 
 
+@functools.lru_cache(maxsize=8)
+def _cached_genai_client(
+    api_choice: str,
+    credentials: str | None,
+    project_id: str | None,
+    location: str | None,
+    credentials_mtime: float | None,
+):
+    # ``credentials_mtime`` only takes part in the cache key.
+    return initialize_genai_client(api_choice, credentials, project_id, location)
+
+
+def get_genai_client(api_choice: str, credentials: str | None, project_id: str | None, location: str | None):
+    """Return a shared Gen AI client, building it on first use.
+
+    Vertex AI clients are keyed on the credentials file's modification time so a
+    rotated service-account JSON produces a fresh client.
+    """
+
+    credentials_mtime = None
+    if api_choice == "Vertex AI" and credentials:
+        try:
+            credentials_mtime = os.path.getmtime(credentials)
+        except OSError:
+            pass
+    return _cached_genai_client(api_choice, credentials, project_id, location, credentials_mtime)
+
+
+def _warm_client(client) -> None:
+    try:
+        next(iter(client.models.list()), None)
+    except Exception:  # pragma: no cover - best effort, the real request reports errors
+        pass
+
+
+def warm_genai_client(client) -> None:
+    """Fetch a Vertex AI *client*'s OAuth token in the background, once per client.
+
+    A cheap model listing makes the shared credentials fetch their token, so
+    the first analysis does not wait for it. Gemini API clients are left
+    alone: an API key needs no token exchange, and the SDK opens a new HTTP
+    session per request, so no connection would be kept.
+    """
+
+    if not client.vertexai or client in _warmed_clients:
+        return
+    _warmed_clients.add(client)
+    threading.Thread(target=_warm_client, args=(client,), name="genai-warmup", daemon=True).start()
+
+
+def clear_genai_client_cache() -> None:
+    """Drop cached Gen AI clients and credentials so the next call rebuilds them."""
+
+    _cached_genai_client.cache_clear()
+    _load_sa_creds.cache_clear()
+
+
+###############################################################################
+# Analysis cache
+###############################################################################
+
+
+def _analysis_cache_key(audio_path: str | Path, prompt: str, model_name: str) -> str:
+    """Return the SHA-256 digest of the audio bytes, *prompt* and *model_name*."""
+
+    digest = hashlib.sha256()
+    with Path(audio_path).open("rb") as audio_file:
+        if os.fstat(audio_file.fileno()).st_size >= _MMAP_THRESHOLD:
+            # Hash straight from the page cache instead of copying into chunk buffers.
+            with mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: audio_file.read(_HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(model_name.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _analysis_cache_path(audio_path: str | Path, prompt: str, model_name: str) -> Path:
+    try:
+        return ANALYSIS_CACHE_DIR / f"{_analysis_cache_key(audio_path, prompt, model_name)}.txt"
+    except OSError as exc:
+        raise RuntimeError(f"Failed to read audio file: {exc}") from exc
+
+
+def _analysis_cache_paths(audio_paths: Sequence[str], prompt: str, model_name: str) -> Dict[str, Path]:
+    return {audio_path: _analysis_cache_path(audio_path, prompt, model_name) for audio_path in audio_paths}
+
+
+def _read_cached_analyses(cache_paths: Dict[str, Path]) -> Dict[str, str]:
+    cached: Dict[str, str] = {}
+    for audio_path, cache_path in cache_paths.items():
+        try:
+            cached[audio_path] = cache_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            pass
+    return cached
+
+
+def _write_cached_analyses(results: Dict[str, str], cache_paths: Dict[str, Path]) -> None:
+    for audio_path, text in results.items():
+        write_text_atomic(cache_paths[audio_path], text)
+
+
 ###############################################################################
 # Analyze Audio
 ###############################################################################
 
 
-def analyze_audio_with_genai(audio_path: str | Path, prompt: str, client, model_name: str) -> str:
-    """Analyse ``audio_path`` using a supplied Gen AI *client*."""
+def _inline_audio_part(audio_path: str | Path) -> types.Part:
+    from google.genai import types
+
+    return types.Part.from_bytes(data=Path(audio_path).read_bytes(), mime_type="audio/mpeg")
+
+
+def _upload_key(audio_path: str | Path) -> Tuple[str, int, int]:
+    stat = os.stat(audio_path)
+    return str(Path(audio_path).resolve()), stat.st_mtime_ns, stat.st_size
+
+
+def _reusable_upload(client, key: Tuple[str, int, int]) -> types.File | None:
+    uploaded_file = _uploaded_files.get(client, {}).get(key)
+    if uploaded_file is None or uploaded_file.expiration_time is None:
+        return uploaded_file
+    if uploaded_file.expiration_time - _UPLOAD_EXPIRY_MARGIN <= datetime.datetime.now(datetime.timezone.utc):
+        del _uploaded_files[client][key]
+        return None
+    return uploaded_file
+
+
+async def _upload_audio_async(client, audio_path: str | Path) -> types.File:
+    """Upload *audio_path* through the Files API, reusing a previous upload of the same file."""
+
+    key = _upload_key(audio_path)
+    uploaded_file = _reusable_upload(client, key)
+    if uploaded_file is None:
+        # The sync API on a worker thread, like _stream_text: each job runs its
+        # own event loop, and the shared client's async surface must not be
+        # tied to any one of them.
+        uploaded_file = await asyncio.to_thread(
+            client.files.upload, file=audio_path, config={"mime_type": "audio/mpeg"}
+        )
+        _uploaded_files.setdefault(client, {})[key] = uploaded_file
+    return uploaded_file
+
+
+async def _audio_contents_async(client, audio_paths: Sequence[str | Path]) -> list:
+    """Return request contents for *audio_paths*.
+
+    With the Gemini API the files are uploaded through the Files API, which
+    streams them from disk instead of embedding the bytes in the request.
+    Uploads are reused until shortly before they expire, keyed on path,
+    mtime and size. Vertex AI has no Files API, so the audio is sent inline
+    there. The files of a batch are read or uploaded concurrently.
+    """
+
+    if client.vertexai:
+        return list(
+            await asyncio.gather(*(asyncio.to_thread(_inline_audio_part, audio_path) for audio_path in audio_paths))
+        )
+    return list(await asyncio.gather(*(_upload_audio_async(client, audio_path) for audio_path in audio_paths)))
+
+
+async def _stream_text(client, model_name: str, contents: list) -> AsyncIterator[str]:
+    """Yield the non-empty text chunks of a streamed response.
+
+    The SDK's async stream reads the HTTP body with blocking calls, which
+    would stall every other request on the event loop between chunks, so the
+    sync stream is iterated on a worker thread instead.
+    """
+
+    stream = iter(await asyncio.to_thread(client.models.generate_content_stream, model=model_name, contents=contents))
+    done = object()
+    while (chunk := await asyncio.to_thread(next, stream, done)) is not done:
+        if chunk.text:
+            yield chunk.text
+
+
+async def analyze_audio_stream_async(
+    audio_path: str | Path, prompt: str, client, model_name: str, *, cache: bool = True
+) -> AsyncIterator[str]:
+    """Yield the analysis of ``audio_path`` in chunks as the model produces it.
+
+    Uses the same disk cache as :func:`analyze_audio_batch_async`; a cache
+    hit yields the stored text in one piece.
+    """
 
+    # Hashing the audio and the cache file I/O block, so they run on worker
+    # threads like the request itself.
+    cache_paths = await asyncio.to_thread(_analysis_cache_paths, [audio_path], prompt, model_name)
+    cached = await asyncio.to_thread(_read_cached_analyses, cache_paths) if cache else {}
+    if audio_path in cached:
+        yield cached[audio_path]
+        return
+
+    chunks: List[str] = []
     try:
-        with Path(audio_path).open("rb") as audio_file:
-            audio_bytes = audio_file.read()
+        contents = await _audio_contents_async(client, [audio_path])
+        async for text in _stream_text(client, model_name, [*contents, prompt]):
+            chunks.append(text)
+            yield text
+    except Exception as exc:  # pragma: no cover - depends on remote API
+        raise RuntimeError(f"Gen AI analysis error: {exc}") from exc
+
+    await asyncio.to_thread(_write_cached_analyses, {audio_path: "".join(chunks).strip()}, cache_paths)
+
+
+def split_batch_response(text: str, audio_paths: Sequence[str]) -> Dict[str, str]:
+    """Split a batched response into per-file sections keyed by audio path.
+
+    Files whose section is missing from *text* are left out of the result.
+    """
+
+    sections: Dict[str, str] = {}
+    markers = list(_BATCH_SECTION_RE.finditer(text))
+    for marker, next_marker in zip(markers, markers[1:] + [None]):
+        index = int(marker.group(1)) - 1
+        if not 0 <= index < len(audio_paths):
+            continue
+        end = next_marker.start() if next_marker else len(text)
+        sections[audio_paths[index]] = text[marker.end():end].strip()
+    return sections
+
+
+def _batch_prompt(prompt: str, count: int) -> str:
+    return BATCH_PROMPT_TEMPLATE.format(count=count, prompt=prompt)
 
-        audio_part = types.Part.from_bytes(data=audio_bytes, mime_type="audio/mpeg")
-        response = client.models.generate_content(model=model_name, contents=[audio_part, prompt])
-        return response.text.strip()
+
+def _batch_sections(text: str, audio_paths: Sequence[str]) -> Dict[str, str]:
+    sections = split_batch_response(text, audio_paths)
+    if not sections:
+        raise RuntimeError("Gen AI batch response did not contain any file sections.")
+    return sections
+
+
+async def analyze_audio_batch_async(
+    audio_paths: Sequence[str],
+    prompt: str,
+    client,
+    model_name: str,
+    *,
+    cache: bool = True,
+    on_text: Callable[[str], None] | None = None,
+) -> Dict[str, str]:
+    """Analyse several audio files with a single Gen AI request.
+
+    Returns a mapping of audio path to analysis text. Each file's section is
+    stored in the disk cache under that file's own key, and with *cache* set,
+    files found there are left out of the request; ``cache=False`` skips the
+    lookup but still stores the fresh results. With *on_text*, the response
+    is streamed and each chunk is passed to it as it arrives; the sections
+    are split once the response is complete.
+    """
+
+    paths = list(dict.fromkeys(audio_paths))
+    cache_paths = await asyncio.to_thread(_analysis_cache_paths, paths, prompt, model_name)
+    cached = await asyncio.to_thread(_read_cached_analyses, cache_paths) if cache else {}
+    pending = [audio_path for audio_path in paths if audio_path not in cached]
+    if not pending:
+        return cached
+
+    # A lone uncached file needs no section markers.
+    request_prompt = prompt if len(pending) == 1 else _batch_prompt(prompt, len(pending))
+    try:
+        contents = await _audio_contents_async(client, pending)
+        if on_text is None:
+            response = await asyncio.to_thread(
+                client.models.generate_content, model=model_name, contents=[*contents, request_prompt]
+            )
+            text = response.text
+        else:
+            chunks: List[str] = []
+            async for chunk_text in _stream_text(client, model_name, [*contents, request_prompt]):
+                chunks.append(chunk_text)
+                on_text(chunk_text)
+            text = "".join(chunks)
     except Exception as exc:  # pragma: no cover - depends on remote API
         raise RuntimeError(f"Gen AI analysis error: {exc}") from exc
 
+    sections = {pending[0]: text.strip()} if len(pending) == 1 else _batch_sections(text, pending)
+    await asyncio.to_thread(_write_cached_analyses, sections, cache_paths)
+    results = {**cached, **sections}
+    return {audio_path: results[audio_path] for audio_path in paths if audio_path in results}
+
 
 ###############################################################################
 # Analysis file helpers
 ###############################################################################
 
 
+def analysis_filename_for(audio_file: str | Path) -> str:
+    """Return the analysis file name (without directory) for *audio_file*."""
+
+    return Path(audio_file).stem + _ANALYSIS_SUFFIX
+
+
 def analysis_path_for(audio_file: str | Path) -> Path:
     """Return the expected analysis path for *audio_file*."""
 
     ensure_output_dirs()
-    audio_stem = Path(audio_file).stem
-    return ANALYSIS_DIR / f"{audio_stem}_analysis.txt"
+    return ANALYSIS_DIR / analysis_filename_for(audio_file)
+
+
+def _scan_analysis_names() -> Set[str]:
+    with os.scandir(ANALYSIS_DIR) as entries:
+        return {entry.name for entry in entries if entry.name.endswith(_ANALYSIS_SUFFIX)}
+
+
+def existing_analysis_filenames() -> Set[str]:
+    """Return the names of all analysis files using a single directory scan."""
+
+    ensure_output_dirs()
+    try:
+        return _scan_analysis_names()
+    except FileNotFoundError:
+        # The folder was removed after ensure_output_dirs() cached its result.
+        recreate_output_dirs()
+        return _scan_analysis_names()
+
+
+@functools.lru_cache(maxsize=128)
+def _read_analysis(path: str, mtime_ns: int) -> str:
+    """Read an analysis file; *mtime_ns* only keys the cache."""
+
+    with open(path, "rb") as analysis_file:
+        if os.fstat(analysis_file.fileno()).st_size < _READ_MMAP_THRESHOLD:
+            return analysis_file.read().decode("utf-8", "replace")
+        # Decode straight from the page cache instead of buffering the bytes first.
+        with mmap.mmap(analysis_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, "utf-8", "replace")
+
+
+def read_analysis(analysis_path: str | Path) -> str:
+    """Return the text of *analysis_path*, re-reading it only after it changes."""
+
+    return _read_analysis(str(analysis_path), os.stat(analysis_path).st_mtime_ns)
 
 
 def load_existing_analysis(audio_file: str | Path) -> Tuple[bool, str | None]:
     """Load the stored analysis for *audio_file* if it exists."""
 
-    analysis_path = analysis_path_for(audio_file)
-    if analysis_path.exists():
-        return True, analysis_path.read_text(encoding="utf-8")
-    return False, None
+    try:
+        return True, read_analysis(analysis_path_for(audio_file))
+    except FileNotFoundError:
+        return False, None
 
 
-def get_all_existing_analyses() -> List[Tuple[str, Path]]:
-    """Return ``(audio_filename, analysis_path)`` pairs for saved analyses."""
+@functools.lru_cache(maxsize=8)
+def _prompt_digest(prompt: str, model_name: str) -> str:
+    return hashlib.sha256(f"{prompt}\0{model_name}".encode("utf-8")).hexdigest()[:16]
+
+
+def analysis_fingerprint(audio_file: str | Path, prompt: str, model_name: str) -> str | None:
+    """Return what an analysis of *audio_file* depends on, or ``None`` if the audio is missing.
+
+    The fingerprint combines the audio file's mtime and size with a digest of
+    *prompt* and *model_name*, so a stored analysis goes stale when any changes.
+    """
+
+    try:
+        stat = os.stat(audio_file)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}:{_prompt_digest(prompt, model_name)}"
+
+
+def _index_record(analysis_name: str, fingerprint: str | None = None) -> str:
+    audio_filename = analysis_name[:-_ANALYSIS_SUFFIX_LEN] + ".mp3"
+    record = {
+        "audio": audio_filename,
+        "path": str(ANALYSIS_DIR / analysis_name),
+        "fingerprint": fingerprint,
+        "ts": time.time(),
+    }
+    return json.dumps(record) + "\n"
+
+
+def rebuild_analysis_index() -> None:
+    """Rewrite :data:`ANALYSIS_INDEX` from the analysis files on disk.
+
+    Fingerprints recorded in the old index are kept for files that still exist.
+    """
+
+    # A rebuild is the recovery path after editing the output folder by hand,
+    # so recreate the directories even if they already existed once.
+    recreate_output_dirs()
+    try:
+        fingerprints = _recorded_fingerprints(_read_index(os.stat(ANALYSIS_INDEX).st_mtime_ns))
+    except FileNotFoundError:
+        fingerprints = {}
+    names = sorted(_scan_analysis_names())
+    write_text_atomic(ANALYSIS_INDEX, "".join(_index_record(name, fingerprints.get(name)) for name in names))
+
+
+def record_analysis(analysis_path: str | Path, fingerprint: str | None = None) -> None:
+    """Append *analysis_path* to :data:`ANALYSIS_INDEX`, building the index if needed.
+
+    *fingerprint* comes from :func:`analysis_fingerprint` for the inputs the
+    analysis was produced from.
+    """
+
+    if not ANALYSIS_INDEX.exists():
+        # The rebuild lists this file too, but cannot know its fingerprint;
+        # the record appended below supersedes that entry.
+        rebuild_analysis_index()
+
+    with ANALYSIS_INDEX.open("a", encoding="utf-8") as index_file:
+        index_file.write(_index_record(Path(analysis_path).name, fingerprint))
+
+
+@functools.lru_cache(maxsize=1)
+def _read_index(mtime_ns: int) -> Dict[str, Dict[str, Any]]:
+    """Read :data:`ANALYSIS_INDEX` into the latest record per audio file; *mtime_ns* only keys the cache."""
+
+    records: Dict[str, Dict[str, Any]] = {}
+    with ANALYSIS_INDEX.open(encoding="utf-8") as index_file:
+        for line in index_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted write
+            records[record["audio"]] = record
+    return records
+
+
+def _recorded_fingerprints(records: Dict[str, Dict[str, Any]]) -> Dict[str, str | None]:
+    return {Path(record["path"]).name: record.get("fingerprint") for record in records.values()}
+
+
+def _index_mtime_ns() -> int:
+    """Return the index's modification time, rebuilding the index if it is missing."""
 
     ensure_output_dirs()
-    analyses: List[Tuple[str, Path]] = []
-    for analysis_file in sorted(ANALYSIS_DIR.glob("*_analysis.txt")):
-        audio_filename = f"{analysis_file.stem.removesuffix('_analysis')}.mp3"
-        analyses.append((audio_filename, analysis_file))
-    return analyses
+    try:
+        return os.stat(ANALYSIS_INDEX).st_mtime_ns
+    except FileNotFoundError:
+        # Missing index or output folder; the rebuild recreates both.
+        rebuild_analysis_index()
+        return os.stat(ANALYSIS_INDEX).st_mtime_ns
+
+
+@functools.lru_cache(maxsize=1)
+def _list_analyses(mtime_ns: int) -> Tuple[Tuple[str, Path], ...]:
+    return tuple(sorted((audio, Path(record["path"])) for audio, record in _read_index(mtime_ns).items()))
+
+
+def existing_analysis_fingerprints() -> Dict[str, str | None]:
+    """Map each analysis file on disk to the fingerprint it was saved with.
+
+    Files saved without a fingerprint, e.g. by older versions, map to ``None``.
+    """
+
+    recorded = _recorded_fingerprints(_read_index(_index_mtime_ns()))
+    return {name: recorded.get(name) for name in existing_analysis_filenames()}
+
+
+def get_all_existing_analyses() -> List[Tuple[str, Path]]:
+    """Return ``(audio_filename, analysis_path)`` pairs for saved analyses.
+
+    The pairs come from :data:`ANALYSIS_INDEX`, which is re-read only when it
+    changes and rebuilt from a directory scan when missing.
+    """
+
+    return list(_list_analyses(_index_mtime_ns()))
@@ -2,22 +2,36 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Final, List, Tuple
 
 import streamlit as st
 
+from analysis_jobs import (
+    BATCH_CANCELLED,
+    BATCH_DONE,
+    BATCH_FAILED,
+    BATCH_RUNNING,
+    AnalysisJob,
+    BatchProgress,
+    start_analysis_job,
+    start_pipeline_job,
+)
 from analysis_utils import (
-    analyze_audio_with_genai,
+    clear_genai_client_cache,
+    existing_analysis_fingerprints,
     get_all_existing_analyses,
-    initialize_genai_client,
+    get_genai_client,
     load_existing_analysis,
+    read_analysis,
+    rebuild_analysis_index,
+    warm_genai_client,
 )
 from app_utils import (
+    chunked_by_size,
     error_message,
     info_message,
     list_audio_files,
     render_markdown,
-    save_analysis,
     should_skip_analysis,
     show_text_area,
     success_message,
@@ -28,7 +42,7 @@ from video_processing import process_videos_in_directory
 ###############################################################################
 # Constants and Defaults
 ###############################################################################
-DEFAULT_PROMPT = """Analyze this audio for specific examples of [target topic] - these are instances where [explain what you're looking for].
+DEFAULT_PROMPT: Final[str] = """Analyze this audio for specific examples of [target topic] - these are instances where [explain what you're looking for].
 
 Please start with a brief overview of what the audio is about.
 
@@ -47,9 +61,21 @@ End with your assessment: How confident are you these were genuine examples of [
 
 If no clear examples are found, simply state that."""
 
+TARGET_TOPIC_PLACEHOLDER: Final[str] = "[target topic]"
+
 DEFAULT_MODEL = "gemini-2.5-flash"
 DEFAULT_GCP_PROJECT = "my-gcp-project"
 DEFAULT_GCP_LOCATION = "us-east1"
+DEFAULT_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 8
+# Upper bound on the audio sent in one batched request. Vertex AI sends audio
+# inline as base64 (4 bytes per 3), where the whole request must stay under
+# about 20 MB; 14 MiB of raw audio encodes to ~19.6 MB, leaving room for the prompt.
+MAX_BATCH_BYTES = 50 * 1024 * 1024
+MAX_INLINE_BATCH_BYTES = 14 * 1024 * 1024
+DEFAULT_CONCURRENCY = 5
+MAX_CONCURRENCY = 16
+ANALYSIS_POLL_INTERVAL = 0.5  # seconds
 
 ###############################################################################
 # Session state helpers
@@ -93,11 +119,15 @@ def initialise_session_state() -> None:
 
     defaults = {
         "analysis_prompt": DEFAULT_PROMPT,
+        "target_topic": "",
         "api_choice": "Gemini API",
         "credentials": "",
         "project_id": DEFAULT_GCP_PROJECT,
         "location": DEFAULT_GCP_LOCATION,
         "model_name": DEFAULT_MODEL,
+        "batch_size": DEFAULT_BATCH_SIZE,
+        "concurrency": DEFAULT_CONCURRENCY,
+        "skip_reanalysis": True,
         "processed_audio_files": [],
     }
 
@@ -109,23 +139,82 @@ def initialise_session_state() -> None:
         st.session_state._secrets_applied = True
 
 
+def _warm_client() -> None:
+    """Build the Vertex AI client for the configured credentials and fetch its token early."""
+
+    if not st.session_state.credentials or st.session_state.api_choice != "Vertex AI":
+        return
+    try:
+        client = get_genai_client(
+            st.session_state.api_choice,
+            st.session_state.credentials,
+            st.session_state.project_id,
+            st.session_state.location,
+        )
+    except RuntimeError:
+        # Reported when the user runs an analysis.
+        return
+    warm_genai_client(client)
+
+
+def _prepare_analysis() -> Tuple[object, str] | None:
+    """Return the Gen AI client and filled-in prompt, or ``None`` after showing an error."""
+
+    if not st.session_state.credentials:
+        error_message("Please provide your API key or GCP credentials JSON file.")
+        return None
+
+    try:
+        client = get_genai_client(
+            st.session_state.api_choice,
+            st.session_state.credentials,
+            st.session_state.project_id,
+            st.session_state.location,
+        )
+    except RuntimeError as exc:
+        error_message(str(exc))
+        return None
+
+    # Fill in the prompt once so every request (and cache key) sees the same text.
+    prompt = st.session_state.analysis_prompt
+    if st.session_state.target_topic:
+        prompt = prompt.replace(TARGET_TOPIC_PLACEHOLDER, st.session_state.target_topic)
+    return client, prompt
+
+
+def _max_batch_bytes() -> int:
+    return MAX_INLINE_BATCH_BYTES if st.session_state.api_choice == "Vertex AI" else MAX_BATCH_BYTES
+
+
+def _analysis_job_running() -> bool:
+    job: AnalysisJob | None = st.session_state.get("analysis_job")
+    return job is not None and not job.finished
+
+
 ###############################################################################
 # UI Sections
 ###############################################################################
+# Each section is a fragment, so interacting with a widget only reruns the
+# section it belongs to. Sections share state through ``st.session_state``.
 
 
+@st.fragment
 def render_prompt_input() -> None:
     with st.expander("Prompt Configuration", expanded=True):
         if st.button("Reset to Default Prompt"):
             st.session_state.analysis_prompt = DEFAULT_PROMPT
 
-        st.session_state.analysis_prompt = st.text_area(
-            "Analysis Prompt:",
-            value=st.session_state.analysis_prompt,
-            height=250,
+        # Bound by key, so the widgets read and write session state directly
+        # instead of copying the prompt back on every rerun.
+        st.text_area("Analysis Prompt:", key="analysis_prompt", height=250)
+        st.text_input(
+            "Target Topic:",
+            key="target_topic",
+            help=f"Substituted for {TARGET_TOPIC_PLACEHOLDER} in the prompt before analysis.",
         )
 
 
+@st.fragment
 def render_api_configuration() -> None:
     with st.expander("API Configuration", expanded=True):
         st.session_state.api_choice = st.radio(
@@ -136,6 +225,27 @@ def render_api_configuration() -> None:
         )
 
         st.session_state.model_name = st.text_input("Model Name:", value=st.session_state.model_name)
+        st.session_state.batch_size = int(
+            st.number_input(
+                "Audio files per request:",
+                min_value=1,
+                max_value=MAX_BATCH_SIZE,
+                value=st.session_state.batch_size,
+                help=(
+                    "Send several audio files in a single Gen AI request. Use 1 to analyze each file "
+                    "separately. Requests are also capped by total audio size."
+                ),
+            )
+        )
+        st.session_state.concurrency = int(
+            st.number_input(
+                "Concurrent requests:",
+                min_value=1,
+                max_value=MAX_CONCURRENCY,
+                value=st.session_state.concurrency,
+                help="Number of Gen AI requests to run at the same time.",
+            )
+        )
 
         st.write("---")
         st.markdown("#### Credentials")
@@ -166,17 +276,57 @@ def render_api_configuration() -> None:
                 help="Enter path to your GCP service account credentials JSON file",
             )
 
+        if st.button("Reset Client", help="Discard the cached Gen AI client and reconnect on the next analysis."):
+            clear_genai_client_cache()
+            info_message("Gen AI client will be recreated on the next analysis.")
+
 
+@st.fragment
 def render_video_to_audio() -> None:
     with st.expander("Video to Audio Conversion", expanded=True):
         video_folder = st.text_input("Video Folder Path:", "./videos")
 
-        if st.button("Convert Videos to Audio"):
+        convert_column, pipeline_column = st.columns(2)
+        convert = convert_column.button("Convert Videos to Audio")
+        pipeline = pipeline_column.button(
+            "Convert and Analyze",
+            disabled=_analysis_job_running(),
+            help="Start analyzing each batch of audio as soon as it is converted, using the analysis settings below.",
+        )
+
+        if pipeline:
+            folder = Path(video_folder)
+            if not folder.is_dir():
+                error_message("Invalid folder path. Please enter a valid directory.")
+                return
+            prepared = _prepare_analysis()
+            if prepared is None:
+                return
+            client, prompt = prepared
+            st.session_state.analysis_job = start_pipeline_job(
+                folder,
+                prompt,
+                client,
+                st.session_state.model_name,
+                batch_size=st.session_state.batch_size,
+                max_batch_bytes=_max_batch_bytes(),
+                concurrency=st.session_state.concurrency,
+                skip_existing=st.session_state.skip_reanalysis,
+            )
+            # Rerun the whole app so the analysis section starts polling the job.
+            st.rerun()
+
+        if convert:
             folder = Path(video_folder)
             if folder.is_dir():
-                with st.spinner("Converting videos to audio..."):
-                    audio_files = process_videos_in_directory(folder)
-                    st.session_state.processed_audio_files = audio_files
+                progress_bar = st.progress(0.0, text="Converting videos to audio...")
+
+                def update_progress(completed: int, total: int) -> None:
+                    progress_bar.progress(completed / total, text=f"Processed {completed} of {total} videos")
+
+                audio_files = process_videos_in_directory(folder, on_progress=update_progress)
+                st.session_state.processed_audio_files = audio_files
+                progress_bar.empty()
 
                 if st.session_state.processed_audio_files:
                     success_message(
@@ -196,72 +346,141 @@ def _render_analysis_tabs(display_name: str, content: str) -> None:
         render_markdown(content)
 
 
+def _render_batch_results(batch: BatchProgress) -> None:
+    results = batch.results
+    for audio_file, audio_name in zip(batch.audio_files, batch.audio_names):
+        response_text = results.get(audio_file)
+        if response_text is None:
+            error_message(f"Failed to analyze {audio_file}. Error: no section in batched response.")
+            continue
+
+        if len(batch.audio_files) > 1:
+            st.markdown(f"##### `{audio_name}`")
+        _render_analysis_tabs(audio_name, response_text)
+        success_message(f"Saved analysis for `{audio_name}`")
+
+
+def _render_skipped_files(skipped_files: List[str]) -> None:
+    for audio_file in skipped_files:
+        audio_name = Path(audio_file).name
+        info_message(f"Skipping `{audio_name}` (analysis is up to date).")
+        found, content = load_existing_analysis(audio_file)
+        if not found:
+            warning_message(f"Analysis file for `{audio_name}` no longer exists.")
+        elif content:
+            st.markdown(f"---\n\n#### Existing Analysis: `{audio_name}`")
+            _render_analysis_tabs(audio_name, content)
+
+
+def _render_analysis_job(job: AnalysisJob) -> None:
+    job.drain()
+
+    # While the job runs, each poll draws only the progress and the running
+    # requests; skipped files and finished requests are drawn once it is done.
+    if job.finished:
+        _render_skipped_files(job.skipped_files)
+
+    if job.conversion is not None:
+        completed, total = job.conversion
+        if total and completed < total:
+            st.progress(completed / total, text=f"Processed {completed} of {total} videos")
+        elif job.finished and not total and not job.conversion_error:
+            warning_message("No videos were converted.")
+    if job.conversion_error:
+        error_message(f"Video conversion failed: {job.conversion_error}")
+
+    # st.status cannot be used here: it is an expander, and this section already is one.
+    if job.batches:
+        st.progress(
+            job.completed / len(job.batches),
+            text=f"Finished {job.completed} of {len(job.batches)} requests",
+        )
+
+    for batch in job.batches:
+        if not job.finished and batch.status != BATCH_RUNNING:
+            continue
+        batch_names = ", ".join(f"`{audio_name}`" for audio_name in batch.audio_names)
+        # One element per header keeps the number of deltas sent on each poll down.
+        st.markdown(f"---\n\n#### Analysis: {batch_names} ({batch.status})")
+        if batch.status == BATCH_RUNNING and batch.text:
+            render_markdown(batch.text)
+        elif batch.status == BATCH_FAILED:
+            error_message(f"Failed to analyze {batch_names}. Error: {batch.error}")
+        elif batch.status == BATCH_CANCELLED:
+            warning_message("Cancelled before it started.")
+        elif batch.status == BATCH_DONE:
+            _render_batch_results(batch)
+
+    if job.finished:
+        success_message("Analysis complete!")
+        if st.session_state.get("_analysis_polling"):
+            # Rerun the whole app so this section stops polling and the viewer picks up new files.
+            st.rerun()
+
+
+# Not decorated with @st.fragment: main() wraps it so it can poll while a job runs.
 def render_audio_analysis() -> None:
     with st.expander("Analyze Audio Files", expanded=True):
-        skip_reanalysis = st.checkbox("Skip re-analysis if file already exists?", value=True)
+        skip_reanalysis = st.checkbox("Skip re-analysis if an up-to-date analysis exists?", key="skip_reanalysis")
 
         existing_audio_files = list_audio_files()
-        if existing_audio_files:
+        if existing_audio_files and existing_audio_files != st.session_state.processed_audio_files:
             st.session_state.processed_audio_files = existing_audio_files
 
-        if st.button("Run Analysis"):
-            audio_files = st.session_state.processed_audio_files
+        job: AnalysisJob | None = st.session_state.get("analysis_job")
+        job_running = _analysis_job_running()
+        if job_running and st.button("Cancel Analysis"):
+            job.cancel()
+
+        if st.button("Run Analysis", disabled=job_running):
+            # Order-preserving dedupe so no file is sent to the model twice.
+            audio_files = list(dict.fromkeys(st.session_state.processed_audio_files))
             if not audio_files:
                 warning_message("No audio files found to analyze.")
                 return
 
-            if not st.session_state.credentials:
-                error_message("Please provide your API key or GCP credentials JSON file.")
-                return
-
-            try:
-                client = initialize_genai_client(
-                    st.session_state.api_choice,
-                    st.session_state.credentials,
-                    st.session_state.project_id,
-                    st.session_state.location,
-                )
-            except RuntimeError as exc:
-                error_message(str(exc))
+            prepared = _prepare_analysis()
+            if prepared is None:
                 return
+            client, prompt = prepared
 
-            st.markdown("### Starting Analysis")
+            # One directory scan and index read up front instead of one per file.
+            existing_analyses = existing_analysis_fingerprints() if skip_reanalysis else None
+            skipped_files = []
+            pending_files = []
             for audio_file in audio_files:
-                audio_name = Path(audio_file).name
-
-                if skip_reanalysis and should_skip_analysis(audio_file, skip_reanalysis=True):
-                    info_message(f"Skipping `{audio_name}` (analysis file exists).")
-                    exists, content = load_existing_analysis(audio_file)
-                    if exists and content:
-                        st.markdown("---")
-                        st.markdown(f"#### Existing Analysis: `{audio_name}`")
-                        _render_analysis_tabs(audio_name, content)
-                    continue
-
-                st.markdown("---")
-                st.markdown(f"#### Analyzing: `{audio_name}`")
-                try:
-                    response_text = analyze_audio_with_genai(
-                        audio_file,
-                        st.session_state.analysis_prompt,
-                        client,
-                        st.session_state.model_name,
-                    )
-                except RuntimeError as exc:
-                    error_message(f"Failed to analyze {audio_file}. Error: {exc}")
-                    continue
-
-                save_analysis(audio_file, response_text)
-                _render_analysis_tabs(audio_name, response_text)
-                success_message(f"Saved analysis for `{audio_name}`")
+                if should_skip_analysis(
+                    audio_file, skip_reanalysis, prompt, st.session_state.model_name, existing_analyses
+                ):
+                    skipped_files.append(audio_file)
+                else:
+                    pending_files.append(audio_file)
+
+            st.session_state.analysis_job = start_analysis_job(
+                list(chunked_by_size(pending_files, st.session_state.batch_size, _max_batch_bytes())),
+                skipped_files,
+                prompt,
+                client,
+                st.session_state.model_name,
+                concurrency=st.session_state.concurrency,
+                cache=skip_reanalysis,
+            )
+            # Rerun the whole app so this section is re-registered as a polling fragment.
+            st.rerun()
 
-            success_message("Analysis complete!")
+        if job is not None:
+            st.markdown("### Analysis")
+            _render_analysis_job(job)
 
 
+@st.fragment
 def render_analysis_viewer() -> None:
     """Renders a viewer for existing analysis files."""
 
     with st.expander("View Existing Analyses", expanded=True):
+        if st.button("Rebuild Analysis Index", help="Rescan output/analysis, e.g. after adding or deleting files by hand."):
+            rebuild_analysis_index()
+
         existing_analyses = get_all_existing_analyses()
 
         if not existing_analyses:
@@ -282,8 +501,12 @@ def render_analysis_viewer() -> None:
                 None,
             )
 
-            if selected_file and selected_file.exists():
-                content = selected_file.read_text(encoding="utf-8")
+            if selected_file:
+                try:
+                    content = read_analysis(selected_file)
+                except FileNotFoundError:
+                    warning_message(f"Analysis file `{selected_file}` no longer exists. Try rebuilding the index.")
+                    return
                 _render_analysis_tabs(selected_analysis, content)
 
 
@@ -294,6 +517,7 @@ def render_analysis_viewer() -> None:
 
 def main() -> None:
     initialise_session_state()
+    _warm_client()
 
     st.title("NeedleInAVidStack")
     st.write("Bulk process video audio to find specific examples, timestamps, or segments using Google Gen AI.")
@@ -301,7 +525,11 @@ def main() -> None:
     render_prompt_input()
     render_api_configuration()
     render_video_to_audio()
-    render_audio_analysis()
+    # While a job runs, poll it so progress shows up without blocking the other sections.
+    job = st.session_state.get("analysis_job")
+    st.session_state._analysis_polling = job is not None and not job.finished
+    run_every = ANALYSIS_POLL_INTERVAL if st.session_state._analysis_polling else None
+    st.fragment(render_audio_analysis, run_every=run_every)()
     render_analysis_viewer()
 
 
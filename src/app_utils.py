@@ -1,36 +1,114 @@
 """Application-level helpers shared by the Streamlit UI."""
 from __future__ import annotations
 
-from typing import List
+import functools
+import os
+from typing import Dict, Iterator, List, Sequence, Tuple
 
 import streamlit as st
 
-from analysis_utils import analysis_path_for
-from paths import AUDIO_DIR, ensure_output_dirs
-
-
-def should_skip_analysis(audio_file: str, skip_reanalysis: bool) -> bool:
-    """Return ``True`` when an analysis already exists and skipping is enabled."""
+from analysis_utils import (
+    analysis_filename_for,
+    analysis_fingerprint,
+    analysis_path_for,
+    existing_analysis_fingerprints,
+    record_analysis,
+)
+from paths import AUDIO_DIR, ensure_output_dirs, recreate_output_dirs, write_text_atomic
+
+
+def should_skip_analysis(
+    audio_file: str,
+    skip_reanalysis: bool,
+    prompt: str,
+    model_name: str,
+    existing: Dict[str, str | None] | None = None,
+) -> bool:
+    """Return ``True`` when skipping is enabled and the stored analysis is still current.
+
+    An analysis is current when it was saved for the same audio file, prompt
+    and model (see :func:`analysis_fingerprint`). Pass *existing* from
+    :func:`existing_analysis_fingerprints` when checking many files, so the
+    folder and index are read once instead of per file.
+    """
 
     if not skip_reanalysis:
         return False
 
-    analysis_file = analysis_path_for(audio_file)
-    return analysis_file.exists()
+    if existing is None:
+        existing = existing_analysis_fingerprints()
+    analysis_name = analysis_filename_for(audio_file)
+    if analysis_name not in existing:
+        return False
+
+    current = analysis_fingerprint(audio_file, prompt, model_name)
+    stored = existing[analysis_name]
+    if stored is None and current is not None:
+        # Analyses saved before fingerprints were recorded are kept, as with
+        # legacy MP3s in ``iter_converted_audio``; the current inputs are
+        # recorded for them so later changes are detected.
+        record_analysis(analysis_path_for(audio_file), current)
+        existing[analysis_name] = stored = current
+    return stored == current
 
 
-def save_analysis(audio_file: str, text: str) -> None:
-    """Persist ``text`` for ``audio_file`` in the analysis directory."""
+def save_analysis(audio_file: str, text: str, prompt: str, model_name: str) -> None:
+    """Persist ``text`` for ``audio_file`` in the analysis directory.
+
+    *prompt* and *model_name* are recorded so :func:`should_skip_analysis` can
+    tell when the analysis goes stale.
+    """
 
     analysis_file = analysis_path_for(audio_file)
-    analysis_file.write_text(text, encoding="utf-8")
+    # Each file stands for a paid model call, so flush it to disk before it
+    # replaces the old one; a crash then never leaves a file that looks done.
+    write_text_atomic(analysis_file, text, durable=True)
+    record_analysis(analysis_file, analysis_fingerprint(audio_file, prompt, model_name))
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_audio_files(mtime_ns: int) -> Tuple[str, ...]:
+    """Scan :data:`AUDIO_DIR`; *mtime_ns* only keys the cache."""
+
+    with os.scandir(AUDIO_DIR) as entries:
+        # is_file() answers from the directory entry's type and only stats
+        # symlinks, which are kept when they point at a file.
+        return tuple(sorted(entry.path for entry in entries if entry.name.endswith(".mp3") and entry.is_file()))
 
 
 def list_audio_files() -> List[str]:
-    """Return all MP3 files currently stored in :data:`AUDIO_DIR`."""
+    """Return all MP3 files currently stored in :data:`AUDIO_DIR`.
+
+    The directory is only rescanned when its modification time changes.
+    """
 
     ensure_output_dirs()
-    return sorted(str(path) for path in AUDIO_DIR.glob("*.mp3"))
+    try:
+        return list(_cached_audio_files(os.stat(AUDIO_DIR).st_mtime_ns))
+    except FileNotFoundError:
+        # The folder was removed after ensure_output_dirs() cached its result.
+        recreate_output_dirs()
+        return list(_cached_audio_files(os.stat(AUDIO_DIR).st_mtime_ns))
+
+
+def chunked_by_size(paths: Sequence[str], max_items: int, max_bytes: int) -> Iterator[List[str]]:
+    """Yield consecutive lists of at most *max_items* paths totalling at most *max_bytes*.
+
+    A file larger than *max_bytes* on its own still gets a batch to itself.
+    """
+
+    max_items = max(1, max_items)
+    batch: List[str] = []
+    batch_bytes = 0
+    for path in paths:
+        size = os.stat(path).st_size
+        if batch and (len(batch) >= max_items or batch_bytes + size > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(path)
+        batch_bytes += size
+    if batch:
+        yield batch
 
 
 def info_message(message: str) -> None:
@@ -1,16 +1,59 @@
 """Common filesystem helpers for NeedleInAVidStack."""
 from __future__ import annotations
 
+import functools
+import os
+import threading
 from pathlib import Path
 from typing import Tuple
 
 OUTPUT_DIR = Path("output")
 AUDIO_DIR = OUTPUT_DIR / "audio"
 ANALYSIS_DIR = OUTPUT_DIR / "analysis"
+ANALYSIS_CACHE_DIR = ANALYSIS_DIR / ".cache"
+ANALYSIS_INDEX = ANALYSIS_DIR / "index.jsonl"
+CONVERSION_INDEX = AUDIO_DIR / "sources.json"
 
 
+@functools.lru_cache(maxsize=1)
 def ensure_output_dirs() -> Tuple[Path, Path]:
-    """Ensure that the audio and analysis directories exist."""
+    """Ensure that the audio and analysis directories exist.
+
+    Only the first call per process touches the filesystem; use
+    :func:`recreate_output_dirs` if the directories may have been removed.
+    """
     AUDIO_DIR.mkdir(parents=True, exist_ok=True)
     ANALYSIS_DIR.mkdir(parents=True, exist_ok=True)
     return AUDIO_DIR, ANALYSIS_DIR
+
+
+def recreate_output_dirs() -> Tuple[Path, Path]:
+    """Create the output directories again, e.g. after they were deleted."""
+
+    ensure_output_dirs.cache_clear()
+    return ensure_output_dirs()
+
+
+def write_text_atomic(path: Path, text: str, *, durable: bool = False) -> None:
+    """Replace *path* with *text* in one step so readers never see a partial file.
+
+    The data is written to a temporary sibling with a single ``os.write`` and
+    renamed over *path*. Set *durable* to ``fsync`` the data before the rename.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    data = memoryview(text.encode("utf-8"))
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            if durable:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -1,17 +1,28 @@
 """Utilities for turning videos into audio clips."""
 from __future__ import annotations
 
+import json
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Iterable, List
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
-from moviepy.editor import VideoFileClip
-from pydub import AudioSegment
-
-from paths import AUDIO_DIR, ensure_output_dirs
+from paths import AUDIO_DIR, CONVERSION_INDEX, ensure_output_dirs, write_text_atomic
 
 # Supported video file extensions.
 VIDEO_EXTENSIONS: tuple[str, ...] = (".mp4", ".avi", ".mov", ".mkv")
 
+# Speech-oriented output: mono at 16 kHz is all the model needs, and 32 kbit/s
+# MP3 keeps about an hour of audio under the default size limit.
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_CHANNELS = 1
+DEFAULT_BITRATE_KBPS = 32
+
+# Lowest MP3 bitrate used when a long video has to be squeezed under the size limit.
+_MIN_BITRATE_KBPS = 8
+
 
 def _iter_video_files(directory: Path) -> Iterable[Path]:
     for path in directory.iterdir():
@@ -19,68 +30,216 @@ def _iter_video_files(directory: Path) -> Iterable[Path]:
             yield path
 
 
-def video_to_audio(video_path: str | Path, max_size_mb: int = 15) -> str | None:
-    """Convert *video_path* into an MP3 file saved in :data:`AUDIO_DIR`."""
+def _probe_audio(source: Path) -> Tuple[bool, float | None]:
+    """Return whether *source* has an audio track and its duration in seconds."""
+
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "a",
+            "-show_entries", "stream=index:format=duration",
+            "-of", "json",
+            str(source),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    probe = json.loads(result.stdout or "{}")
+    try:
+        duration_s = float(probe.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        duration_s = None
+    return bool(probe.get("streams")), duration_s
+
+
+def _target_bitrate_kbps(duration_s: float | None, max_size_mb: int, bitrate_kbps: int) -> int:
+    """Return *bitrate_kbps*, lowered if needed to keep *duration_s* of audio under *max_size_mb*."""
+
+    if not duration_s:
+        return bitrate_kbps
+    return max(_MIN_BITRATE_KBPS, min(bitrate_kbps, int((max_size_mb * 8192) / duration_s)))
+
+
+def _audio_path_for(video_path: Path) -> Path:
+    return AUDIO_DIR / f"{video_path.stem}.mp3"
+
+
+def _source_signature(video_path: Path) -> Dict[str, int]:
+    stat = video_path.stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _load_conversion_index() -> Dict[str, Dict[str, int]]:
+    """Return the recorded source signatures, keyed on resolved video path."""
+
+    try:
+        return json.loads(CONVERSION_INDEX.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def video_to_audio(
+    video_path: str | Path,
+    max_size_mb: int = 15,
+    ffmpeg_threads: int | None = None,
+    overwrite: bool = False,
+    *,
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    channels: int = DEFAULT_CHANNELS,
+    bitrate_kbps: int = DEFAULT_BITRATE_KBPS,
+) -> str | None:
+    """Convert *video_path* into an MP3 file saved in :data:`AUDIO_DIR`.
+
+    The audio track is decoded, resampled to *sample_rate* / *channels* and
+    encoded at *bitrate_kbps* by a single ffmpeg process. The bitrate is
+    lowered up front, from the probed duration, when needed to stay under
+    *max_size_mb*. *ffmpeg_threads* limits the threads ffmpeg may use. An
+    existing MP3 is kept unless *overwrite* is set.
+    """
 
     ensure_output_dirs()
     source = Path(video_path)
-    base_name = source.stem
-
-    temp_audio = AUDIO_DIR / f"{base_name}_temp.wav"
-    final_audio = AUDIO_DIR / f"{base_name}.mp3"
+    final_audio = _audio_path_for(source)
+    # Not an ``.mp3`` name, so a half-written file never shows up as audio to analyze.
+    temp_audio = AUDIO_DIR / f".{final_audio.name}.{os.getpid()}.tmp"
 
-    if final_audio.exists():
+    if not overwrite and final_audio.exists():
         print(f"Audio file already exists for {source}, skipping conversion.")
         return str(final_audio)
 
     try:
-        with VideoFileClip(str(source)) as clip:
-            if clip.audio is None:
-                print(f"No audio track found in {source}.")
-                return None
-            clip.audio.write_audiofile(str(temp_audio), logger=None)
-    except Exception as exc:  # pragma: no cover - moviepy raises many runtime errors
-        print(f"Error extracting audio from {source}: {exc}")
+        has_audio, duration_s = _probe_audio(source)
+    except subprocess.CalledProcessError as exc:
+        print(f"Error probing {source}: {exc.stderr.strip() or exc}")
+        return None
+    except (OSError, ValueError) as exc:
+        print(f"Error probing {source}: {exc}")
+        return None
+    if not has_audio:
+        print(f"No audio track found in {source}.")
         return None
 
-    try:
-        audio = AudioSegment.from_file(temp_audio, format="wav")
-        current_size = temp_audio.stat().st_size / (1024 * 1024)
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", str(source),
+        "-vn", "-ac", str(channels), "-ar", str(sample_rate),
+        "-c:a", "libmp3lame", "-b:a", f"{_target_bitrate_kbps(duration_s, max_size_mb, bitrate_kbps)}k",
+    ]
+    if ffmpeg_threads:
+        command += ["-threads", str(ffmpeg_threads)]
+    command += ["-f", "mp3", str(temp_audio)]
 
-        if current_size <= max_size_mb:
-            audio.export(final_audio, format="mp3", bitrate="192k")
-        else:
-            duration_s = len(audio) / 1000
-            target_bitrate = int((max_size_mb * 8192) / duration_s)
-            bitrate = max(32, min(192, target_bitrate))
-            audio.export(final_audio, format="mp3", bitrate=f"{bitrate}k")
-    except Exception as exc:  # pragma: no cover - depends on external codecs
-        print(f"Error processing audio file {temp_audio}: {exc}")
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+        os.replace(temp_audio, final_audio)
+    except subprocess.CalledProcessError as exc:
+        print(f"Error converting {source}: {exc.stderr.strip() or exc}")
+        return None
+    except OSError as exc:
+        print(f"Error converting {source}: {exc}")
         return None
     finally:
-        if temp_audio.exists():
-            temp_audio.unlink()
+        temp_audio.unlink(missing_ok=True)
 
     return str(final_audio)
 
 
-def process_videos_in_directory(directory: str | Path) -> List[str]:
-    """Convert every supported video inside *directory* to audio."""
+def _convert_one(video_file: Path, ffmpeg_threads: int) -> str | None:
+    # Module-level so it can be pickled for worker processes.
+    return video_to_audio(video_file, ffmpeg_threads=ffmpeg_threads, overwrite=True)
+
+
+def iter_converted_audio(directory: str | Path, max_workers: int | None = None) -> Iterator[Tuple[str | None, int, int]]:
+    """Convert every supported video inside *directory*, yielding as each one finishes.
+
+    Yields ``(audio_file, completed, total)``, with ``audio_file`` ``None`` for
+    videos that failed. Videos are converted in parallel worker processes (up
+    to ``os.cpu_count()`` by default), each ffmpeg getting an equal share of
+    the cores. An existing MP3 is reused, and yielded first, while its
+    video's size and modification time match those recorded in
+    :data:`CONVERSION_INDEX`.
+    """
 
     directory_path = Path(directory)
     if not directory_path.is_dir():
         print(f"Invalid directory: {directory}")
-        return []
-
-    processed_audio_files: List[str] = []
+        return
 
+    ensure_output_dirs()
+    conversions = _load_conversion_index()
+    reused: List[str] = []
+    pending: Dict[Path, Tuple[str, Dict[str, int]]] = {}
     for video_file in sorted(_iter_video_files(directory_path)):
-        print(f"Processing {video_file.name}...")
-        output_path = video_to_audio(video_file)
-        if output_path:
-            processed_audio_files.append(output_path)
-            print(f"Created audio file: {output_path}")
+        source_key = str(video_file.resolve())
+        signature = _source_signature(video_file)
+        audio_file = _audio_path_for(video_file)
+        # MP3s converted before sources were recorded have no entry; keep them.
+        if audio_file.exists() and conversions.setdefault(source_key, signature) == signature:
+            print(f"Audio file already exists for {video_file}, skipping conversion.")
+            reused.append(str(audio_file))
         else:
-            print(f"Failed to process {video_file.name}")
+            pending[video_file] = (source_key, signature)
+
+    total = len(reused) + len(pending)
+    try:
+        for completed, audio_file in enumerate(reused, start=1):
+            yield audio_file, completed, total
+
+        if not pending:
+            return
+
+        # Split the cores between the workers so the ffmpeg processes neither
+        # oversubscribe the machine nor leave cores idle when there are few videos.
+        cpu_count = os.cpu_count() or 1
+        workers = min(max_workers or cpu_count, len(pending))
+        ffmpeg_threads = max(1, cpu_count // workers)
+
+        # "spawn" avoids forking the multi-threaded Streamlit server process.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                executor.submit(_convert_one, video_file, ffmpeg_threads): video_file for video_file in pending
+            }
+            try:
+                for completed, future in enumerate(as_completed(futures), start=len(reused) + 1):
+                    video_file = futures[future]
+                    output_path = future.result()
+                    if output_path:
+                        source_key, signature = pending[video_file]
+                        conversions[source_key] = signature
+                        print(f"Created audio file: {output_path}")
+                    else:
+                        print(f"Failed to process {video_file.name}")
+                    yield output_path, completed, total
+            except GeneratorExit:
+                # Closed early, e.g. by a cancelled job: drop the videos not
+                # started yet so the pool only waits for those in progress.
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        write_text_atomic(CONVERSION_INDEX, json.dumps(conversions, indent=1))
 
-    return processed_audio_files
+
+def process_videos_in_directory(
+    directory: str | Path,
+    max_workers: int | None = None,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> List[str]:
+    """Convert every supported video inside *directory* to audio.
+
+    See :func:`iter_converted_audio`. *on_progress* is called with
+    ``(completed, total)`` after each video is done.
+    """
+
+    processed_audio_files: List[str] = []
+    for audio_file, completed, total in iter_converted_audio(directory, max_workers):
+        if audio_file:
+            processed_audio_files.append(audio_file)
+        if on_progress:
+            on_progress(completed, total)
+
+    # Videos sharing a stem (e.g. talk.mp4 and talk.mov) map to the same audio file.
+    return sorted(set(processed_audio_files))